@@ -1,2 +1,2 @@
 from .imflow import image_dataset_from_csv, image_dataset_from_dataframe, image_dataset_from_directory, image_dataset_from_paths_and_labels
-from . import utils
\ No newline at end of file
+from . import convert, utils
\ No newline at end of file
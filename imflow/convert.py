@@ -0,0 +1,81 @@
+# Copyright 2022 Pranav Kulkarni. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+'''One-time conversion utilities for faster loading.'''
+
+import os
+import numpy as np
+import tensorflow.compat.v2 as tf
+
+TENSOR_FORMAT = '.tensor'
+
+def numpy_to_tensor(paths, output_dir=None):
+  '''Converts `.npy`/`.npz` files to serialized `float32` tensor files.
+
+  The converted files are decoded entirely inside the TensorFlow graph by
+  `imflow`, avoiding the `tf.numpy_function` fallback (and the Python GIL) used
+  for `.npy`/`.npz` files. 2D arrays are stored with a trailing channel axis.
+
+  Args:
+    paths: List of paths to `.npy` or `.npz` files. For `.npz` files, the
+      array stored under `arr_0` is converted.
+    output_dir: Optional directory to write the converted files to, created if
+      it does not exist. Defaults to `None`, in which case each file is written
+      next to its source.
+
+  Returns:
+    List of paths to the converted files, in the same order as `paths`.
+
+  Raises:
+    ValueError: if two files would be converted to the same path, e.g. files
+      with the same name in different directories when `output_dir` is set.
+  '''
+  paths = [os.fspath(path) for path in paths]
+  # Check all output paths up front, so that a collision does not overwrite
+  # files that were already converted
+  tensor_paths = []
+  sources = {}
+  for path in paths:
+    root = os.path.splitext(path)[0]
+    if output_dir is not None:
+      root = os.path.join(output_dir, os.path.basename(root))
+    tensor_path = root + TENSOR_FORMAT
+    if tensor_path in sources:
+      raise ValueError(
+        f'Files {sources[tensor_path]} and {path} would both be converted to {tensor_path}. Convert them to different `output_dir`s instead.'
+      )
+    sources[tensor_path] = path
+    tensor_paths.append(tensor_path)
+  if output_dir is not None:
+    tf.io.gfile.makedirs(output_dir)
+  for path, tensor_path in zip(paths, tensor_paths):
+    ext = os.path.splitext(path)[1]
+    if ext == '.npz':
+      with np.load(path) as f:
+        x = f['arr_0']
+    elif ext == '.npy':
+      x = np.load(path)
+    else:
+      raise ValueError(
+        f'Expected a `.npy` or `.npz` file. Received: path={path}'
+      )
+    x = x.astype(np.float32)
+    if x.ndim == 2:
+      x = np.expand_dims(x, axis=-1)
+    if x.ndim != 3:
+      raise ValueError(
+        f'Expected an array with shape (height, width) or (height, width, channels). Received: shape={x.shape} for path={path}'
+      )
+    tf.io.write_file(tensor_path, tf.io.serialize_tensor(x))
+  return tensor_paths
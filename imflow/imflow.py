@@ -16,6 +16,7 @@
 # ==============================================================================
 '''ImFlow'''
 
+import functools
 import sys
 import numpy as np
 import pandas as pd
@@ -24,9 +25,28 @@ import tensorflow.compat.v2 as tf
 import nibabel as nib
 import pydicom
 
-from .utils import dataset_utils, image_utils
-
-ALLOWLIST_FORMATS = ('.bmp', '.gif', '.jpeg', '.jpg', '.png', '.dcm')
+from .utils import dataset_utils, image_utils, numpy_utils
+
+ALLOWLIST_FORMATS = ('.bmp', '.gif', '.jpeg', '.jpg', '.png', '.dcm', '.tensor')
+
+# Branch codes used by `load_image`, any other extension decodes as a standard image
+_EXT_CODE = {
+  'dcm': 0,
+  'npz': 1,
+  'npy': 2,
+  'tensor': 3,
+  'jpg': 4,
+  'jpeg': 4,
+  'png': 5,
+  'bmp': 6,
+  'gif': 7,
+}
+# Only the end of a path, long enough for `.` plus the longest known extension,
+# has to be searched for the extension
+_EXT_WINDOW = max(len(ext) for ext in _EXT_CODE) + 1
+
+# Number of paths decoded per `tf.data` map call
+DECODE_BATCH_SIZE = 32
 
 def paths_and_labels_to_dataset(
   image_paths,
@@ -37,54 +57,184 @@ def paths_and_labels_to_dataset(
   num_classes,
   interpolation,
   resize_with_pad=False,
+  dtype=tf.float32,
+  resize_backend='tensorflow',
+  decode_batch_size=DECODE_BATCH_SIZE,
+  deterministic=None,
 ):
   '''Constructs a dataset of images and labels.'''
-  path_ds = tf.data.Dataset.from_tensor_slices(image_paths)
-  args = (image_size, num_channels, interpolation, resize_with_pad)
-  img_ds = path_ds.map(
-    lambda x: load_image(x, *args), num_parallel_calls=tf.data.AUTOTUNE
-  )
+  ds = tf.data.Dataset.from_tensor_slices(image_paths)
   if label_mode:
     label_ds = dataset_utils.labels_to_dataset(
       labels, label_mode, num_classes
     )
-    img_ds = tf.data.Dataset.zip((img_ds, label_ds))
-  return img_ds
-
-def numpy_channels(x, num_channels):
+    # Pair paths with labels before decoding so out of order reads stay matched
+    ds = tf.data.Dataset.zip((ds, label_ds))
+  # Bind the pipeline constants once, so that every branch in `load_image` is
+  # specialized for them when traced
+  load_fn = functools.partial(
+    load_image,
+    # One table per dataset, created in the same graph as the dataset itself
+    extension_table=_extension_table(),
+    image_size=image_size,
+    num_channels=num_channels,
+    interpolation=interpolation,
+    resize_with_pad=resize_with_pad,
+    dtype=dtype,
+    resize_backend=resize_backend,
+  )
+  img_spec = tf.TensorSpec((image_size[0], image_size[1], num_channels), dtype)
+
+  def load_images(paths, *labels):
+    imgs = tf.map_fn(
+      load_fn,
+      paths,
+      fn_output_signature=img_spec,
+      parallel_iterations=decode_batch_size,
+    )
+    return (imgs,) + labels if labels else imgs
+
+  # Decode paths in small batches to amortize the per-element map overhead,
+  # and interleave the batches so that several file reads are in flight
+  ds = ds.batch(decode_batch_size).interleave(
+    lambda *x: tf.data.Dataset.from_tensors(x).map(load_images),
+    cycle_length=tf.data.AUTOTUNE,
+    num_parallel_calls=tf.data.AUTOTUNE,
+    deterministic=deterministic,
+  ).unbatch()
+  return ds
+
+def dataset_options(deterministic=None, input_context=None):
+  '''Returns the `tf.data.Options` attached to every generated dataset.'''
+  options = tf.data.Options()
+  if deterministic is not None:
+    options.deterministic = deterministic
+  if input_context is not None:
+    # Files are already sharded per input pipeline, don't shard them again
+    options.experimental_distribute.auto_shard_policy = (
+      tf.data.experimental.AutoShardPolicy.OFF
+    )
+  options.autotune.enabled = True
+  options.experimental_optimization.map_and_batch_fusion = True
+  options.experimental_optimization.parallel_batch = True
+  return options
+
+def cache_dataset(dataset, cache, subset=None, input_context=None):
+  '''Caches a dataset in memory if `cache` is True, or to files if a string.'''
+  if not cache:
+    return dataset
+  if isinstance(cache, str):
+    # Every subset and input pipeline caches different files
+    if subset:
+      cache = f'{cache}_{subset}'
+    if input_context is not None:
+      cache = f'{cache}_{input_context.input_pipeline_id}'
+    return dataset.cache(cache)
+  return dataset.cache()
+
+def prefetch_dataset(dataset, device=None):
+  '''Prefetches a dataset on the host, or onto `device` if given.'''
+  if device is None:
+    return dataset.prefetch(tf.data.AUTOTUNE)
+  # `copy_to_device` turns off autotuning and the default optimizations, as the
+  # ops they insert would be placed on `device` and cannot cross the copy
+  return dataset.apply(tf.data.experimental.prefetch_to_device(device))
+
+def numpy_image(x):
+  '''Casts a NumPy image to `float32` with a trailing channel axis.
+
+  Channels are only repeated after resizing, see `_resize`.
+  '''
+  x = x.astype(np.float32, copy=False)
   if x.ndim == 2:
     x = np.expand_dims(x, axis=-1)
-    if num_channels == 3:
-      x = np.concatenate((x,)*3, axis=-1)
-    if num_channels == 4:
-      x = np.concatenate((x,)*4, axis=-1)
-    return x
+  return x
 
-def decode_npz_image(path, num_channels):
-  x = np.load(path)['arr_0'].astype(np.float32)
-  return numpy_channels(x, num_channels)
+def decode_npz_image(path):
+  x = numpy_utils.load_npz_array(path, 'arr_0')
+  return numpy_image(x)
   
-def decode_npy_image(path, num_channels):
-  x = np.load(path).astype(np.float32)
-  return numpy_channels(x, num_channels)
+def decode_npy_image(path):
+  # Memory-map so that the cast reads straight from the page cache
+  x = np.load(path, mmap_mode='r')
+  return numpy_image(x)
 
-# def decode_nifti_image(path, num_channels):
+# def decode_nifti_image(path):
 #   x = nib.load(path).get_fdata().astype(np.float32)
-#   return numpy_channels(x, num_channels)
+#   return numpy_image(x)
 
-# def decode_dicom_image(path, num_channels):
+# def decode_dicom_image(path):
 #   x = pydicom.dcmread(path).pixel_array.astype(np.float32)
-#   return numpy_channels(x, num_channels)
+#   return numpy_image(x)
       
+def _broadcast_channels(img, num_channels):
+  return tf.broadcast_to(img, tf.concat([tf.shape(img)[:2], [num_channels]], axis=0))
+
+def _add_alpha(img):
+  alpha = tf.fill(tf.concat([tf.shape(img)[:2], [1]], axis=0), tf.constant(255, dtype=img.dtype))
+  return tf.concat((img, alpha), axis=-1)
+
+def _resize(
+  img,
+  image_size,
+  interpolation,
+  resize_with_pad=False,
+  dtype=tf.float32,
+  resize_backend='tensorflow',
+):
+  '''Resizes a decoded image and casts it to `dtype`.
+
+  Channels that are copies of another channel, or constant like an opaque
+  alpha channel, should be added after resizing so they are not resized too.
+  '''
+  if resize_backend == 'opencv':
+    cv_resize = functools.partial(
+      image_utils.cv_resize,
+      size=tuple(image_size),
+      interpolation=image_utils.get_cv_interpolation(interpolation),
+      pad=resize_with_pad,
+    )
+    channels = img.shape[-1]
+    img = tf.numpy_function(cv_resize, [img], img.dtype)
+    img.set_shape((image_size[0], image_size[1], channels))
+  elif resize_with_pad:
+    img = tf.image.resize_with_pad(img, image_size[0], image_size[1], method=interpolation)
+  else:
+    img = tf.image.resize(img, image_size, method=interpolation)
+  if dtype.is_integer and img.dtype.is_floating:
+    img = tf.round(img)
+  return tf.saturate_cast(img, dtype)
+
+def _extension_table():
+  '''Builds the lookup table mapping file extensions to branch codes.'''
+  return tf.lookup.StaticHashTable(
+    tf.lookup.KeyValueTensorInitializer(
+      list(_EXT_CODE.keys()),
+      list(_EXT_CODE.values()),
+      key_dtype=tf.string,
+      value_dtype=tf.int32,
+    ),
+    default_value=max(_EXT_CODE.values()) + 1,
+  )
+
+def _path_extension(path):
+  '''Returns the lowercase extension of `path`, reading only its last bytes.'''
+  start = tf.maximum(tf.strings.length(path) - _EXT_WINDOW, 0)
+  tail = tf.strings.substr(path, start, _EXT_WINDOW)
+  return tf.strings.lower(tf.strings.split(tail, sep='.')[-1])
+
 def load_image(
   path, 
   image_size, 
   num_channels, 
   interpolation, 
-  resize_with_pad=False
+  resize_with_pad=False,
+  dtype=tf.float32,
+  resize_backend='tensorflow',
+  extension_table=None,
 ):
   '''Load an image from a path and resize it.'''
-  if tf.strings.regex_full_match(path, '.*\.dcm.*'):
+  def _load_dcm():
     # TODO: Add support for Multiframe DICOM
     # TODO: Add support for creating 3D input from MRI/CT slices
     # Idea: Provide each MRI/CT as list of paths to slices in order
@@ -93,51 +243,97 @@ def load_image(
     assert_op = tf.Assert(tf.math.equal(tf.shape(img)[0], 1), ['Multiframe DICOM files are not supported. Received Tensor with shape:', tf.shape(img)])
     with tf.control_dependencies([assert_op]):
       img = tf.squeeze(img, axis=0)
-      if num_channels == 3:
-        img = tf.concat((img, img, img), axis=-1) # changes from 2 to -1
-      elif num_channels == 4:
-        img = tf.concat((img, img, img, tf.math.multiply(tf.ones(tf.shape(img), dtype=tf.uint8), 255)), axis=-1)
-      if resize_with_pad:
-        img = tf.image.resize_with_pad(img, image_size[0], image_size[1], method=interpolation)
-      else:
-        img = tf.image.resize(img, image_size, method=interpolation)
-      img.set_shape((image_size[0], image_size[1], num_channels))
-      return img
-  elif tf.strings.regex_full_match(path, '.*\.npz.*'):
-    img= tf.numpy_function(decode_npz_image, [path, num_channels], tf.float32)
-    if resize_with_pad:
-      img = tf.image.resize_with_pad(img, image_size[0], image_size[1], method=interpolation)
-    else:
-      img = tf.image.resize(img, image_size, method=interpolation)
-    img.set_shape((image_size[0], image_size[1], num_channels))
+    # Resize the single channel first, then expand the resized image
+    img = _resize(img, image_size, interpolation, resize_with_pad, dtype, resize_backend)
+    if num_channels == 3:
+      img = _broadcast_channels(img, 3)
+    elif num_channels == 4:
+      img = _add_alpha(_broadcast_channels(img, 3))
     return img
-  elif tf.strings.regex_full_match(path, '.*\.npy.*'):
-    img= tf.numpy_function(decode_npy_image, [path, num_channels], tf.float32)
-    if resize_with_pad:
-      img = tf.image.resize_with_pad(img, image_size[0], image_size[1], method=interpolation)
-    else:
-      img = tf.image.resize(img, image_size, method=interpolation)
-    img.set_shape((image_size[0], image_size[1], num_channels))
+
+  def _load_npz():
+    img = tf.numpy_function(decode_npz_image, [path], tf.float32)
+    img.set_shape((None, None, None))
+    img = _resize(img, image_size, interpolation, resize_with_pad, dtype, resize_backend)
+    return _broadcast_channels(img, num_channels)
+
+  def _load_npy():
+    img = tf.numpy_function(decode_npy_image, [path], tf.float32)
+    img.set_shape((None, None, None))
+    img = _resize(img, image_size, interpolation, resize_with_pad, dtype, resize_backend)
+    return _broadcast_channels(img, num_channels)
+
+  def _load_tensor():
+    # Serialized `float32` tensors written by `imflow.convert.numpy_to_tensor`
+    img = tf.io.parse_tensor(tf.io.read_file(path), out_type=tf.float32)
+    img = tf.ensure_shape(img, (None, None, None))
+    img = _resize(img, image_size, interpolation, resize_with_pad, dtype, resize_backend)
+    return _broadcast_channels(img, num_channels)
+
+  # def _load_nii():
+  #   img = tf.numpy_function(decode_nifti_image, [path], tf.float32)
+  #   img = _resize(img, image_size, interpolation, resize_with_pad, dtype, resize_backend)
+  #   return _broadcast_channels(img, num_channels)
+
+  def _load_jpeg():
+    img_bytes = tf.io.read_file(path)
+    # JPEG has no alpha channel, decode as RGB and add an opaque one
+    img = tf.image.decode_jpeg(
+      img_bytes, channels=min(num_channels, 3), dct_method='INTEGER_FAST'
+    )
+    img = _resize(img, image_size, interpolation, resize_with_pad, dtype, resize_backend)
+    if num_channels == 4:
+      img = _add_alpha(img)
     return img
-  # elif tf.strings.regex_full_match(path, '.*\.nii.*'):
-  #   img= tf.numpy_function(decode_nifti_image, [path, num_channels], tf.float32)
-  #   if resize_with_pad:
-  #     img = tf.image.resize_with_crop_or_pad(img, image_size[0], image_size[1], method=interpolation)
-  #   else:
-  #     img = tf.image.resize(img, image_size, method=interpolation)
-  #   img.set_shape((image_size[0], image_size[1], num_channels))
-  #   return img
-  else:
+
+  def _load_png():
+    img_bytes = tf.io.read_file(path)
+    img = tf.image.decode_png(img_bytes, channels=num_channels)
+    return _resize(img, image_size, interpolation, resize_with_pad, dtype, resize_backend)
+
+  def _load_bmp():
+    img_bytes = tf.io.read_file(path)
+    img = tf.image.decode_bmp(img_bytes, channels=num_channels)
+    return _resize(img, image_size, interpolation, resize_with_pad, dtype, resize_backend)
+
+  def _load_gif():
+    img_bytes = tf.io.read_file(path)
+    # Animated gifs are truncated to the first frame
+    img = tf.image.decode_gif(img_bytes)[0]
+    if num_channels == 1:
+      img = tf.image.rgb_to_grayscale(img)
+    img = _resize(img, image_size, interpolation, resize_with_pad, dtype, resize_backend)
+    if num_channels == 4:
+      img = _add_alpha(img)
+    return img
+
+  def _load_std():
     img_bytes = tf.io.read_file(path)
     img = tf.image.decode_image(
       img_bytes, channels=num_channels, expand_animations=False
     )
-    if resize_with_pad:
-      img = tf.image.resize_with_pad(img, image_size[0], image_size[1], method=interpolation)
-    else:
-      img = tf.image.resize(img, image_size, method=interpolation)
-    img.set_shape((image_size[0], image_size[1], num_channels))
-    return img
+    return _resize(img, image_size, interpolation, resize_with_pad, dtype, resize_backend)
+
+  # Find the extension from the end of the path, then dispatch on its code
+  if extension_table is None:
+    extension_table = _extension_table()
+  code = extension_table.lookup(_path_extension(path))
+  img = tf.switch_case(
+    code,
+    branch_fns=[
+      _load_dcm,
+      _load_npz,
+      _load_npy,
+      _load_tensor,
+      _load_jpeg,
+      _load_png,
+      _load_bmp,
+      _load_gif,
+      _load_std,
+    ],
+  )
+  img.set_shape((image_size[0], image_size[1], num_channels))
+  return img
 
 # TODO: Update doc
 def image_dataset_from_directory(
@@ -155,6 +351,13 @@ def image_dataset_from_directory(
   interpolation='bilinear',
   follow_links=False,
   resize_with_pad=False,
+  device=None,
+  cache=False,
+  fast_index=False,
+  deterministic=None,
+  dtype='float32',
+  input_context=None,
+  resize_backend='tensorflow',
 ):
   '''Generates a `tf.data.Dataset` from image files in a directory.
 
@@ -218,6 +421,8 @@ def image_dataset_from_directory(
       the same size, this must be provided.
     shuffle: Whether to shuffle the data. Default: True.
       If set to False, sorts the data in alphanumeric order.
+      If set to True, images may also be yielded out of order as soon as
+      they are loaded, unless `deterministic` is set.
     seed: Optional random seed for shuffling and transformations.
     validation_split: Optional float between 0 and 1,
       fraction of data to reserve for validation.
@@ -231,15 +436,55 @@ def image_dataset_from_directory(
     `area`, `lanczos3`, `lanczos5`, `gaussian`, `mitchellcubic`.
     follow_links: Whether to visit subdirectories pointed to by symlinks.
       Defaults to False.
+    fast_index: Whether to index `directory` with TensorFlow's C++ file
+      matching instead of walking it in Python, which is much faster for
+      directories with many files. Only files directly inside each class
+      subdirectory are indexed. Ignored if `follow_links` is True.
+      Defaults to False.
     resize_with_pad: If True, resize the images without aspect
       ratio distortion. When the original aspect ratio differs from the target
       aspect ratio, the output image will be resized with padding so as to return the image that matches the target `image size`. 
       By default (`resize_with_pad=False`), aspect ratio may not be preserved.
+    device: Optional device to prefetch batches to, e.g. `'/GPU:0'`.
+      Images are still decoded on the CPU, but batches are copied to `device`
+      ahead of time so the model does not wait on the host to device copy.
+      Defaults to `None`, in which case batches are prefetched on the host.
+      Cannot be combined with `input_context`, as `tf.distribute` already
+      prefetches batches to each replica's device. Note that TensorFlow turns
+      off autotuning and the default `tf.data` optimizations of pipelines
+      copied to a device, so only set `device` if the host to device copy is
+      the bottleneck.
+    cache: Whether to cache the decoded and resized images, so that they are
+      only loaded from disk during the first epoch. If `True`, images are
+      cached in memory. If a string, images are cached to files with this
+      prefix, suffixed with the subset if `subset` is given and with the
+      input pipeline id if `input_context` is given.
+      Defaults to `False`.
+    deterministic: Whether images must be yielded in a deterministic order.
+      Allowing out of order delivery lets slow reads not hold up the rest of
+      the pipeline. Defaults to `None`, in which case the order is only
+      deterministic if `shuffle` is False.
+    dtype: Dtype of the yielded images, either a floating point dtype or
+      `uint8`. Defaults to `float32`. Using `uint8` makes images 4x smaller in
+      the shuffle buffer, cache and host to device copies; cast them back to
+      float in the model. Values are clipped to `[0, 255]` when casting to
+      `uint8`, so `.npy`/`.npz` files should hold values in that range.
+    input_context: Optional `tf.distribute.InputContext`, as passed to the
+      dataset function of `distribute_datasets_from_function`. If given, each
+      input pipeline only reads its own shard of the image files, and
+      `batch_size` should be the per-replica batch size (see
+      `input_context.get_per_replica_batch_size`). A `seed` must be given
+      when shuffling, so that all input pipelines shuffle the files the same
+      way before sharding them. Defaults to `None`.
+    resize_backend: Library used to resize images, either `'tensorflow'` or
+      `'opencv'`. OpenCV's SIMD resize kernels are faster on CPU, but only
+      support `bilinear`, `nearest`, `bicubic` and `area` interpolation and
+      require OpenCV to be installed. Defaults to `'tensorflow'`.
     **kwargs: Legacy keyword arguments.
 
   Returns:
     A `tf.data.Dataset` object.
-    - If `label_mode` is None, it yields `float32` tensors of shape
+    - If `label_mode` is None, it yields `dtype` tensors of shape
       `(batch_size, image_size[0], image_size[1], num_channels)`,
       encoding images (see below for rules regarding `num_channels`).
     - Otherwise, it yields a tuple `(images, labels)`, where `images`
@@ -291,22 +536,36 @@ def image_dataset_from_directory(
   if labels is None or label_mode is None:
     labels = None
     label_mode = None
+  # Files are shuffled before sharding, which must be done identically by all
+  # input pipelines
+  dataset_utils.check_input_context_arg(input_context, shuffle, seed)
 
   if seed is None:
     seed = np.random.randint(1e6)
 
-  image_paths, labels = dataset_utils.index_directory(
-    directory,
-    labels,
-    label_mode,
-    formats=ALLOWLIST_FORMATS,
-    class_names=class_names,
-    shuffle=shuffle,
-    seed=seed,
-    follow_links=follow_links,
-  )
+  if fast_index and not follow_links:
+    image_paths, labels, class_names = dataset_utils.index_directory_fast(
+      directory,
+      labels,
+      label_mode,
+      formats=ALLOWLIST_FORMATS,
+      class_names=class_names,
+      shuffle=shuffle,
+      seed=seed,
+    )
+  else:
+    image_paths, labels, class_names = dataset_utils.index_directory(
+      directory,
+      labels,
+      label_mode,
+      formats=ALLOWLIST_FORMATS,
+      class_names=class_names,
+      shuffle=shuffle,
+      seed=seed,
+      follow_links=follow_links,
+    )
 
-  return image_dataset_from_paths_and_labels(image_paths, labels, label_mode, color_mode, batch_size, image_size, shuffle, seed, validation_split, subset, interpolation, resize_with_pad)
+  return image_dataset_from_paths_and_labels(image_paths, labels, label_mode, color_mode, batch_size, image_size, shuffle, seed, validation_split, subset, interpolation, resize_with_pad, device, cache, deterministic, dtype, input_context, resize_backend)
 
 # TODO: Add doc
 def image_dataset_from_csv(
@@ -323,10 +582,18 @@ def image_dataset_from_csv(
   validation_split=None,
   subset=None,
   interpolation='bilinear',
-  resize_with_pad=False
+  resize_with_pad=False,
+  device=None,
+  cache=False,
+  deterministic=None,
+  dtype='float32',
+  input_context=None,
+  resize_backend='tensorflow',
 ):
-  df = pd.read_csv(csv_path)
-  return image_dataset_from_dataframe(df, path_col, label_col, image_dir, label_mode, color_mode, batch_size, image_size, shuffle, seed, validation_split, subset, interpolation, resize_with_pad)
+  label_cols = label_col if isinstance(label_col, list) else [label_col]
+  # Only parse the columns in use
+  df = pd.read_csv(csv_path, usecols=[path_col] + label_cols)
+  return image_dataset_from_dataframe(df, path_col, label_col, image_dir, label_mode, color_mode, batch_size, image_size, shuffle, seed, validation_split, subset, interpolation, resize_with_pad, device, cache, deterministic, dtype, input_context, resize_backend)
 
 # TODO: Add doc
 def image_dataset_from_dataframe(
@@ -343,7 +610,13 @@ def image_dataset_from_dataframe(
   validation_split=None,
   subset=None,
   interpolation='bilinear',
-  resize_with_pad=False
+  resize_with_pad=False,
+  device=None,
+  cache=False,
+  deterministic=None,
+  dtype='float32',
+  input_context=None,
+  resize_backend='tensorflow',
 ):
   if not isinstance(path_col, str):
     raise ValueError(
@@ -358,9 +631,9 @@ def image_dataset_from_dataframe(
       f'or None. Received: label_mode={label_mode}'
     )
   image_dir = image_dir + '/' if image_dir != '' and image_dir[-1] != '/' else image_dir
-  image_paths = (image_dir + df[path_col].values).tolist()
-  labels = df[label_col].values.tolist()
-  return image_dataset_from_paths_and_labels(image_paths, labels, label_mode, color_mode, batch_size, image_size, shuffle, seed, validation_split, subset, interpolation, resize_with_pad)
+  image_paths = np.char.add(image_dir, df[path_col].to_numpy(dtype=np.str_))
+  labels = df[label_col].to_numpy()
+  return image_dataset_from_paths_and_labels(image_paths, labels, label_mode, color_mode, batch_size, image_size, shuffle, seed, validation_split, subset, interpolation, resize_with_pad, device, cache, deterministic, dtype, input_context, resize_backend)
 
 # TODO: Update doc
 def image_dataset_from_paths_and_labels(
@@ -375,7 +648,13 @@ def image_dataset_from_paths_and_labels(
   validation_split=None,
   subset=None,
   interpolation='bilinear',
-  resize_with_pad=False
+  resize_with_pad=False,
+  device=None,
+  cache=False,
+  deterministic=None,
+  dtype='float32',
+  input_context=None,
+  resize_backend='tensorflow',
 ):
   '''Generates a `tf.data.Dataset` from image files in a directory.
 
@@ -437,6 +716,8 @@ def image_dataset_from_paths_and_labels(
       the same size, this must be provided.
     shuffle: Whether to shuffle the data. Default: True.
       If set to False, sorts the data in alphanumeric order.
+      If set to True, images may also be yielded out of order as soon as
+      they are loaded, unless `deterministic` is set.
     seed: Optional random seed for shuffling and transformations.
     validation_split: Optional float between 0 and 1,
       fraction of data to reserve for validation.
@@ -454,11 +735,44 @@ def image_dataset_from_paths_and_labels(
       ratio distortion. When the original aspect ratio differs from the target
       aspect ratio, the output image will be resized with padding so as to return the image that matches the target `image size`. 
       By default (`resize_with_pad=False`), aspect ratio may not be preserved.
+    device: Optional device to prefetch batches to, e.g. `'/GPU:0'`.
+      Images are still decoded on the CPU, but batches are copied to `device`
+      ahead of time so the model does not wait on the host to device copy.
+      Defaults to `None`, in which case batches are prefetched on the host.
+      Cannot be combined with `input_context`, as `tf.distribute` already
+      prefetches batches to each replica's device. Note that TensorFlow turns
+      off autotuning and the default `tf.data` optimizations of pipelines
+      copied to a device, so only set `device` if the host to device copy is
+      the bottleneck.
+    cache: Whether to cache the decoded and resized images, so that they are
+      only loaded from disk during the first epoch. If `True`, images are
+      cached in memory. If a string, images are cached to files with this
+      prefix, suffixed with the subset if `subset` is given and with the
+      input pipeline id if `input_context` is given.
+      Defaults to `False`.
+    deterministic: Whether images must be yielded in a deterministic order.
+      Allowing out of order delivery lets slow reads not hold up the rest of
+      the pipeline. Defaults to `None`, in which case the order is only
+      deterministic if `shuffle` is False.
+    dtype: Dtype of the yielded images, either a floating point dtype or
+      `uint8`. Defaults to `float32`. Using `uint8` makes images 4x smaller in
+      the shuffle buffer, cache and host to device copies; cast them back to
+      float in the model. Values are clipped to `[0, 255]` when casting to
+      `uint8`, so `.npy`/`.npz` files should hold values in that range.
+    input_context: Optional `tf.distribute.InputContext`, as passed to the
+      dataset function of `distribute_datasets_from_function`. If given, each
+      input pipeline only reads its own shard of the image files, and
+      `batch_size` should be the per-replica batch size (see
+      `input_context.get_per_replica_batch_size`). Defaults to `None`.
+    resize_backend: Library used to resize images, either `'tensorflow'` or
+      `'opencv'`. OpenCV's SIMD resize kernels are faster on CPU, but only
+      support `bilinear`, `nearest`, `bicubic` and `area` interpolation and
+      require OpenCV to be installed. Defaults to `'tensorflow'`.
     **kwargs: Legacy keyword arguments.
 
   Returns:
     A `tf.data.Dataset` object.
-    - If `label_mode` is None, it yields `float32` tensors of shape
+    - If `label_mode` is None, it yields `dtype` tensors of shape
       `(batch_size, image_size[0], image_size[1], num_channels)`,
       encoding images (see below for rules regarding `num_channels`).
     - Otherwise, it yields a tuple `(images, labels)`, where `images`
@@ -482,9 +796,7 @@ def image_dataset_from_paths_and_labels(
     - if `color_mode` is `rgba`,
     there are 4 channels in the image tensors.
   '''
-  if isinstance(labels, np.ndarray):
-    labels = labels.tolist()
-  if labels != None and not isinstance(labels, (list, tuple)):
+  if labels is not None and not isinstance(labels, (list, tuple, np.ndarray)):
     raise ValueError(
       f'`labels` argument should be a list/tuple of integer labels, of the same size as the number of image files in the target directory. If you wish to infer the labels from the subdirectory names in the target directory, pass `labels="inferred"`. If you wish to get a dataset that only contains images (no labels), pass `labels=None`. Received: labels={labels}'
     )
@@ -506,16 +818,40 @@ def image_dataset_from_paths_and_labels(
       f'`color_mode` must be one of {"rgb", "rgba", "grayscale"}. Received: color_mode={color_mode}'
     )
   
+  dtype = tf.as_dtype(dtype)
+  if not (dtype.is_floating or dtype == tf.uint8):
+    raise ValueError(
+      f'`dtype` must be a floating point dtype or `uint8`. Received: dtype={dtype.name}'
+    )
   interpolation = image_utils.get_interpolation(interpolation)
+  if resize_backend not in ('tensorflow', 'opencv'):
+    raise ValueError(
+      f'`resize_backend` must be one of "tensorflow" or "opencv". Received: resize_backend={resize_backend}'
+    )
+  if resize_backend == 'opencv':
+    image_utils.get_cv_interpolation(interpolation)
+    # Let `tf.data` parallelize across images rather than OpenCV within each
+    image_utils.cv2.setNumThreads(1)
+  if device is not None and input_context is not None:
+    raise ValueError(
+      f'`device` cannot be combined with `input_context`, `tf.distribute` already prefetches batches to each replica. Received: device={device}'
+    )
   dataset_utils.check_validation_split_arg(
     validation_split, subset, shuffle, seed
   )
 
   if seed is None:
     seed = np.random.randint(1e6)
-
-  # Temporarily convert labels to ndarray for quick mafs!
-  labels = np.array(labels)
+  if deterministic is None:
+    deterministic = not shuffle
+
+  # Labels are kept as an ndarray all the way to `tf.data`
+  if labels is not None:
+    labels = np.asarray(labels)
+    # Object arrays (e.g. nullable or categorical DataFrame columns) cannot be
+    # converted by `tf.data`, unpack them into native Python values first
+    if labels.dtype == object:
+      labels = np.array(labels.tolist())
   # Ensure `labels` match format for each `label_mode`
   if label_mode in ('int', 'categorical') and labels.ndim > 1:
     raise ValueError(
@@ -524,11 +860,13 @@ def image_dataset_from_paths_and_labels(
   if label_mode == 'binary':
     if labels.ndim < 2:
       labels = np.expand_dims(labels, axis=-1)
-    if len(np.unique(labels)) != 2:
+    labels = labels.astype(np.float32)
+    # Count both classes instead of sorting all labels with `np.unique`
+    num_positive = np.count_nonzero(labels == 1)
+    if num_positive in (0, labels.size) or np.count_nonzero(labels == 0) != labels.size - num_positive:
       raise ValueError(
-        f'When passing `label_mode="binary"`, there must be exactly 2 classes'
+        f'When passing `label_mode="binary"`, there must be exactly 2 classes, encoded as 0 and 1'
       )
-    labels = labels.astype(float)
   if label_mode in ('multi_class', 'multi_label'):
     if labels.ndim < 2:
       raise ValueError(
@@ -538,21 +876,26 @@ def image_dataset_from_paths_and_labels(
       raise ValueError(
         f'Only a single class/label found, please use `label_mode="binary"` instead!'
       )
-    if label_mode == 'multi_class' and np.max(np.sum(labels, axis=1)) > 1:
+    if label_mode == 'multi_class' and labels.sum(axis=1).max() > 1:
       raise ValueError(
         f'More than one class assigned to label, please use `label_mode="multi_label"` instead!'
       )
   # Calculate `num_classes` from labels
+  num_classes = None
   if label_mode == 'binary':
     num_classes = 2
   if label_mode in ('int', 'categorical'):
-    num_classes = np.max(labels) + 1
+    num_classes = int(labels.max()) + 1
   if label_mode == 'multi_class':
     num_classes = labels.shape[1]
   if label_mode == 'multi_label':
     num_classes = labels.shape[1] + 1
-  # Convert back to list
-  labels = labels.tolist()
+  # Match the dtypes `tf.data` infers for Python lists of labels
+  if labels is not None:
+    if np.issubdtype(labels.dtype, np.integer):
+      labels = labels.astype(np.int32, copy=False)
+    elif np.issubdtype(labels.dtype, np.floating):
+      labels = labels.astype(np.float32, copy=False)
 
   if subset == 'both':
     (
@@ -567,16 +910,22 @@ def image_dataset_from_paths_and_labels(
     ) = dataset_utils.get_training_or_validation_split(
       image_paths, labels, validation_split, 'validation'
     )
-    if not image_paths_train:
+    if len(image_paths_train) == 0:
       raise ValueError(
         f'No training images found in directory. '
         f'Allowed formats: {ALLOWLIST_FORMATS}'
       )
-    if not image_paths_val:
+    if len(image_paths_val) == 0:
       raise ValueError(
         f'No validation images found in directory. '
         f'Allowed formats: {ALLOWLIST_FORMATS}'
       )
+    image_paths_train, labels_train = dataset_utils.shard_input_pipeline(
+      image_paths_train, labels_train, input_context
+    )
+    image_paths_val, labels_val = dataset_utils.shard_input_pipeline(
+      image_paths_val, labels_val, input_context
+    )
     train_dataset = paths_and_labels_to_dataset(
       image_paths=image_paths_train,
       image_size=image_size,
@@ -586,7 +935,11 @@ def image_dataset_from_paths_and_labels(
       num_classes=num_classes,
       interpolation=interpolation,
       resize_with_pad=resize_with_pad,
+      dtype=dtype,
+      resize_backend=resize_backend,
+      deterministic=deterministic,
     )
+    train_dataset = cache_dataset(train_dataset, cache, 'training', input_context)
     val_dataset = paths_and_labels_to_dataset(
       image_paths=image_paths_val,
       image_size=image_size,
@@ -596,9 +949,11 @@ def image_dataset_from_paths_and_labels(
       num_classes=num_classes,
       interpolation=interpolation,
       resize_with_pad=resize_with_pad,
+      dtype=dtype,
+      resize_backend=resize_backend,
+      deterministic=deterministic,
     )
-    train_dataset = train_dataset.prefetch(tf.data.AUTOTUNE)
-    val_dataset = val_dataset.prefetch(tf.data.AUTOTUNE)
+    val_dataset = cache_dataset(val_dataset, cache, 'validation', input_context)
     if batch_size is not None:
       if shuffle:
         # Shuffle locally at each iteration
@@ -612,6 +967,11 @@ def image_dataset_from_paths_and_labels(
         train_dataset = train_dataset.shuffle(
           buffer_size=1024, seed=seed
         )
+    train_dataset = train_dataset.with_options(dataset_options(deterministic, input_context))
+    val_dataset = val_dataset.with_options(dataset_options(deterministic, input_context))
+    # Prefetch last so that whole batches are prepared ahead of time
+    train_dataset = prefetch_dataset(train_dataset, device)
+    val_dataset = prefetch_dataset(val_dataset, device)
 
     # Include file paths for images as attribute.
     train_dataset.file_paths = image_paths_train
@@ -621,11 +981,14 @@ def image_dataset_from_paths_and_labels(
     image_paths, labels = dataset_utils.get_training_or_validation_split(
       image_paths, labels, validation_split, subset
     )
-    if not image_paths:
+    if len(image_paths) == 0:
       raise ValueError(
         f'No images found in directory. '
         f'Allowed formats: {ALLOWLIST_FORMATS}'
       )
+    image_paths, labels = dataset_utils.shard_input_pipeline(
+      image_paths, labels, input_context
+    )
 
     dataset = paths_and_labels_to_dataset(
       image_paths=image_paths,
@@ -636,8 +999,11 @@ def image_dataset_from_paths_and_labels(
       num_classes=num_classes,
       interpolation=interpolation,
       resize_with_pad=resize_with_pad,
+      dtype=dtype,
+      resize_backend=resize_backend,
+      deterministic=deterministic,
     )
-    dataset = dataset.prefetch(tf.data.AUTOTUNE)
+    dataset = cache_dataset(dataset, cache, subset, input_context)
     if batch_size is not None:
       if shuffle:
         # Shuffle locally at each iteration
@@ -647,6 +1013,9 @@ def image_dataset_from_paths_and_labels(
     else:
       if shuffle:
         dataset = dataset.shuffle(buffer_size=1024, seed=seed)
+    dataset = dataset.with_options(dataset_options(deterministic, input_context))
+    # Prefetch last so that whole batches are prepared ahead of time
+    dataset = prefetch_dataset(dataset, device)
 
     # Include file paths for images as attribute.
     dataset.file_paths = image_paths
@@ -514,25 +514,7 @@ def index_directory(
       class_names: names of the classes corresponding to these labels, in
         order.
   """
-  if labels == 'inferred':
-    subdirs = []
-    for subdir in sorted(tf.io.gfile.listdir(directory)):
-      if tf.io.gfile.isdir(tf.io.gfile.join(directory, subdir)):
-        if subdir.endswith("/"):
-          subdir = subdir[:-1]
-        subdirs.append(subdir)
-    if not class_names:
-      class_names = subdirs
-    else:
-      if set(class_names) != set(subdirs):
-        raise ValueError(
-          "The `class_names` passed did not match the "
-          "names of the subdirectories of the target directory. "
-          f"Expected: {subdirs}, but received: {class_names}"
-        )
-  else:
-    subdirs = [""]
-    class_names = []
+  subdirs, class_names = get_class_subdirs(directory, labels, class_names)
 
   class_indices = dict(zip(class_names, range(len(class_names))))
 
@@ -554,48 +536,179 @@ def index_directory(
     partial_filenames, partial_labels = res.get()
     labels_list.append(partial_labels)
     filenames += partial_filenames
-  if labels not in ("inferred", None):
-    if len(labels) != len(filenames):
-      raise ValueError(
-        "Expected the lengths of `labels` to match the number "
-        "of files in the target directory. len(labels) is "
-        f"{len(labels)} while we found {len(filenames)} files "
-        f"in directory {directory}."
+  pool.close()
+  pool.join()
+  file_paths = [tf.io.gfile.join(directory, fname) for fname in filenames]
+  return finalize_index(
+    directory, file_paths, labels, labels_list, label_mode, class_names,
+    shuffle, seed
+  )
+
+
+def index_directory_fast(
+  directory,
+  labels,
+  label_mode,
+  formats,
+  class_names=None,
+  shuffle=True,
+  seed=None,
+):
+  """Make list of all files in the subdirs of `directory` in a single listing.
+
+  Faster alternative to `index_directory` for large directories: each
+  subdirectory is listed with a single `tf.io.gfile.listdir` call and filtered
+  with vectorized NumPy string operations, instead of walking the tree in
+  Python. Unlike
+  `index_directory`, only files directly inside each subdirectory are indexed
+  and symlinks are not followed.
+
+  Args:
+    directory: The target directory (string).
+    labels: Either "inferred"
+      (labels are generated from the directory structure),
+      None (no labels),
+      or a list/tuple of integer labels of the same size as the number of
+      valid files found in the directory. Labels should be sorted according
+      to the alphanumeric order of the image file paths.
+    label_mode:
+    formats: Allowlist of file extensions to index (e.g. ".jpg", ".txt").
+    class_names: Only valid if "labels" is "inferred". This is the explicit
+      list of class names (must match names of subdirectories). Used
+      to control the order of the classes
+      (otherwise alphanumerical order is used).
+    shuffle: Whether to shuffle the data. Default: True.
+      If set to False, sorts the data in alphanumeric order.
+    seed: Optional random seed for shuffling.
+
+  Returns:
+    tuple (file_paths, labels, class_names).
+      file_paths: NumPy array of file paths (strings).
+      labels: matching integer labels (same length as file_paths)
+      class_names: names of the classes corresponding to these labels, in
+        order.
+  """
+  subdirs, class_names = get_class_subdirs(directory, labels, class_names)
+
+  class_indices = dict(zip(class_names, range(len(class_names))))
+
+  file_paths = [np.array([], dtype=np.str_)]
+  labels_list = [np.array([], dtype="int32")]
+  for subdir in subdirs:
+    # List rather than glob, so that names containing glob metacharacters such
+    # as `[` or `*` are not treated as patterns
+    dirpath = tf.io.gfile.join(directory, subdir, "")
+    names = np.array(tf.io.gfile.listdir(dirpath), dtype=np.str_)
+    lower_names = np.char.lower(names)
+    valid = np.zeros(len(names), dtype=bool)
+    for ext in formats:
+      valid |= np.char.endswith(lower_names, ext)
+    paths = np.char.add(dirpath, np.sort(names[valid]))
+    file_paths.append(paths)
+    # In no label mode, don't append unneccessary labels
+    if len(class_indices) != 0:
+      labels_list.append(
+        np.full(len(paths), class_indices[subdir], dtype="int32")
       )
-  elif labels != None:
-    i = 0
-    labels = np.zeros((len(filenames),), dtype="int32")
-    for partial_labels in labels_list:
-      labels[i : i + len(partial_labels)] = partial_labels
-      i += len(partial_labels)
+  file_paths = np.concatenate(file_paths)
+  return finalize_index(
+    directory, file_paths, labels, labels_list, label_mode, class_names,
+    shuffle, seed
+  )
+
+
+def finalize_index(
+  directory,
+  file_paths,
+  labels,
+  labels_list,
+  label_mode,
+  class_names,
+  shuffle=True,
+  seed=None,
+):
+  """Check, report and shuffle the files found by the `index_directory*`s.
+
+  Args:
+    directory: The target directory (string).
+    file_paths: List or NumPy array of the file paths found, sorted.
+    labels: The `labels` argument of the indexer.
+    labels_list: List of the inferred integer labels of each subdirectory, in
+      the same order as `file_paths`.
+    label_mode: The `label_mode` argument of the indexer.
+    class_names: Names of the classes corresponding to the labels, in order.
+    shuffle: Whether to shuffle the data. Default: True.
+    seed: Optional random seed for shuffling.
+
+  Returns:
+    tuple (file_paths, labels, class_names), with `file_paths` of the same
+    type as passed in.
+  """
+  if labels is None:
+    pass
+  elif isinstance(labels, str):
+    labels = np.concatenate(
+      [np.array([], dtype="int32")] + [np.asarray(partial_labels) for partial_labels in labels_list]
+    ).astype("int32")
+  elif len(labels) != len(file_paths):
+    raise ValueError(
+      "Expected the lengths of `labels` to match the number "
+      "of files in the target directory. len(labels) is "
+      f"{len(labels)} while we found {len(file_paths)} files "
+      f"in directory {directory}."
+    )
 
   if len(class_names) > 0:
     print(
-      f"Found {len(filenames)} files belonging "
+      f"Found {len(file_paths)} files belonging "
       f"to {len(class_names)} classes."
     )
   else:
     if label_mode is None:
-      print(f"Found {len(filenames)} files.")
+      print(f"Found {len(file_paths)} files.")
     else:
-      print(f"Found {len(filenames)} files with `{label_mode}` label mode.")
-    
-  pool.close()
-  pool.join()
-  file_paths = [tf.io.gfile.join(directory, fname) for fname in filenames]
+      print(f"Found {len(file_paths)} files with `{label_mode}` label mode.")
 
   if shuffle:
-    # Shuffle globally to erase macro-structure
+    # Shuffle globally to erase macro-structure, applying the same permutation
+    # to explicit labels without modifying the caller's list in place
     if seed is None:
       seed = np.random.randint(1e6)
     rng = np.random.RandomState(seed)
-    rng.shuffle(file_paths)
-    if isinstance(labels, np.ndarray):
-      rng = np.random.RandomState(seed)
-      rng.shuffle(labels)
+    perm = rng.permutation(len(file_paths))
+    if isinstance(file_paths, np.ndarray):
+      file_paths = file_paths[perm]
+    else:
+      file_paths = [file_paths[i] for i in perm]
+    if labels is not None:
+      labels = np.asarray(labels)[perm]
   return file_paths, labels, class_names
 
 
+def get_class_subdirs(directory, labels, class_names=None):
+  """List the subdirectories of `directory` to index, and their class names."""
+  if labels == 'inferred':
+    subdirs = []
+    for subdir in sorted(tf.io.gfile.listdir(directory)):
+      if tf.io.gfile.isdir(tf.io.gfile.join(directory, subdir)):
+        if subdir.endswith("/"):
+          subdir = subdir[:-1]
+        subdirs.append(subdir)
+    if not class_names:
+      class_names = subdirs
+    else:
+      if set(class_names) != set(subdirs):
+        raise ValueError(
+          "The `class_names` passed did not match the "
+          "names of the subdirectories of the target directory. "
+          f"Expected: {subdirs}, but received: {class_names}"
+        )
+  else:
+    subdirs = [""]
+    class_names = []
+  return subdirs, class_names
+
+
 def iter_valid_files(directory, follow_links, formats):
   if not follow_links:
     walk = tf.io.gfile.walk(directory)
@@ -642,8 +755,8 @@ def get_training_or_validation_split(samples, labels, validation_split, subset):
   """Potentially restict samples & labels to a training or validation split.
 
   Args:
-    samples: List of elements.
-    labels: List of corresponding labels.
+    samples: List or NumPy array of elements.
+    labels: List or NumPy array of corresponding labels, or None.
     validation_split: Float, fraction of data to reserve for validation.
     subset: Subset of the data to return.
     Either "training", "validation", or None. If None, we return all of the
@@ -651,19 +764,24 @@ def get_training_or_validation_split(samples, labels, validation_split, subset):
 
   Returns:
     tuple (samples, labels), potentially restricted to the specified subset.
+    Splits are returned as NumPy arrays (views of `samples` and `labels`).
   """
   if not validation_split:
     return samples, labels
 
+  samples = np.asarray(samples)
+  if labels is not None:
+    labels = np.asarray(labels)
   num_val_samples = int(validation_split * len(samples))
+  split = len(samples) - num_val_samples
   if subset == "training":
-    print(f"Using {len(samples) - num_val_samples} files for training.")
-    samples = samples[:-num_val_samples]
-    labels = labels[:-num_val_samples]
+    print(f"Using {split} files for training.")
+    samples = samples[:split]
+    labels = labels[:split] if labels is not None else None
   elif subset == "validation":
     print(f"Using {num_val_samples} files for validation.")
-    samples = samples[-num_val_samples:]
-    labels = labels[-num_val_samples:]
+    samples = samples[split:]
+    labels = labels[split:] if labels is not None else None
   else:
     raise ValueError(
       '`subset` must be either "training" '
@@ -672,11 +790,37 @@ def get_training_or_validation_split(samples, labels, validation_split, subset):
   return samples, labels
 
 
+def shard_input_pipeline(samples, labels, input_context=None):
+  """Restrict samples & labels to the shard read by one input pipeline.
+
+  Args:
+    samples: List or NumPy array of elements.
+    labels: List or NumPy array of corresponding labels, or None.
+    input_context: Optional `tf.distribute.InputContext`. If None, we return
+    all of the data.
+
+  Returns:
+    tuple (samples, labels), restricted to every `num_input_pipelines`-th
+    element starting at `input_pipeline_id`.
+  """
+  if input_context is None:
+    return samples, labels
+
+  shard = slice(
+    input_context.input_pipeline_id, None, input_context.num_input_pipelines
+  )
+  samples = np.asarray(samples)[shard]
+  if labels is not None:
+    labels = np.asarray(labels)[shard]
+  return samples, labels
+
+
 def labels_to_dataset(labels, label_mode, num_classes):
-  """Create a tf.data.Dataset from the list/tuple of labels.
+  """Create a tf.data.Dataset from the list/tuple or NumPy array of labels.
 
   Args:
-    labels: list/tuple of labels to be converted into a tf.data.Dataset.
+    labels: list/tuple or NumPy array of labels to be converted into a
+      tf.data.Dataset. NumPy arrays are converted in a single copy.
     label_mode: String describing the encoding of `labels`. Options are:
     - 'binary' indicates that the labels (there can be only 2) are encoded as
     `float32` scalars with values 0 or 1 (e.g. for `binary_crossentropy`).
@@ -702,6 +846,22 @@ def labels_to_dataset(labels, label_mode, num_classes):
   return label_ds
 
 
+def check_input_context_arg(input_context, shuffle, seed):
+  """Raise errors in case of invalid argument values for distributed input.
+
+  Args:
+    input_context: Optional `tf.distribute.InputContext`.
+    shuffle: Whether to shuffle the data. Either True or False.
+    seed: random seed for shuffling and transformations.
+  """
+  if input_context is not None and shuffle and seed is None:
+    raise ValueError(
+      "If using `input_context` and shuffling the data, you must "
+      "provide a `seed` argument, to make sure that every input pipeline "
+      "shuffles the files the same way and that their shards do not overlap."
+    )
+
+
 def check_validation_split_arg(validation_split, subset, shuffle, seed):
   """Raise errors in case of invalid argument values.
 
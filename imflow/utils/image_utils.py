@@ -26,6 +26,11 @@ import tensorflow.compat.v2 as tf
 
 from keras import backend
 
+try:
+  import cv2
+except ImportError:
+  cv2 = None
+
 try:
   from PIL import Image as pil_image
 
@@ -61,6 +66,14 @@ _TF_INTERPOLATION_METHODS = {
   "mitchellcubic": ResizeMethod.MITCHELLCUBIC,
 }
 
+if cv2 is not None:
+  _CV_INTERPOLATION_METHODS = {
+    "bilinear": cv2.INTER_LINEAR,
+    "nearest": cv2.INTER_NEAREST,
+    "bicubic": cv2.INTER_CUBIC,
+    "area": cv2.INTER_AREA,
+  }
+
 def smart_resize(x, size, interpolation="bilinear"):
   """Resize images to a target size without aspect ratio distortion.
 
@@ -194,6 +207,59 @@ def get_interpolation(interpolation):
     )
   return _TF_INTERPOLATION_METHODS[interpolation]
 
+def get_cv_interpolation(interpolation):
+  if cv2 is None:
+    raise ImportError(
+      "Could not import cv2. "
+      "The use of `resize_backend='opencv'` requires OpenCV."
+    )
+  interpolation = interpolation.lower()
+  if interpolation not in _CV_INTERPOLATION_METHODS:
+    raise NotImplementedError(
+      "Value not recognized for `interpolation` with "
+      "`resize_backend='opencv'`: {}. Supported values "
+      "are: {}".format(interpolation, _CV_INTERPOLATION_METHODS.keys())
+    )
+  return _CV_INTERPOLATION_METHODS[interpolation]
+
+def cv_resize(x, size, interpolation, pad=False):
+  """Resizes an image with OpenCV, matching `tf.image.resize(_with_pad)`.
+
+  Args:
+    x: NumPy image of shape `(height, width, channels)`.
+    size: Tuple of `(height, width)` integer. Target size.
+    interpolation: OpenCV interpolation flag, see `get_cv_interpolation`.
+    pad: Whether to resize without aspect ratio distortion, padding the
+      resized image with zeros like `tf.image.resize_with_pad`.
+
+  Returns:
+    NumPy image of shape `(size[0], size[1], channels)`, with the same dtype
+    as `x`.
+  """
+  height, width = x.shape[:2]
+  target_height, target_width = size
+  if pad:
+    ratio = max(width / target_width, height / target_height)
+    resized_height = int(height / ratio)
+    resized_width = int(width / ratio)
+  else:
+    resized_height, resized_width = target_height, target_width
+  img = cv2.resize(x, (resized_width, resized_height), interpolation=interpolation)
+  # OpenCV drops the channel axis of single channel images
+  img = img.reshape((resized_height, resized_width, x.shape[2]))
+  if pad:
+    top = (target_height - resized_height) // 2
+    left = (target_width - resized_width) // 2
+    img = np.pad(
+      img,
+      (
+        (top, target_height - resized_height - top),
+        (left, target_width - resized_width - left),
+        (0, 0),
+      ),
+    )
+  return img
+
 def array_to_img(x, data_format=None, scale=True, dtype=None):
   """Converts a 3D Numpy array to a PIL Image instance.
 
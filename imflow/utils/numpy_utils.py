@@ -0,0 +1,71 @@
+# Copyright 2022 Pranav Kulkarni. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Utilities for decoding NumPy images."""
+
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+
+def load_npz_array(path, key="arr_0"):
+  """Loads an array from a `.npz` file, without reading it if possible.
+
+  Arrays saved with `np.savez` are stored uncompressed, so they can be
+  memory-mapped straight from the archive like `np.load(mmap_mode="r")` does
+  for `.npy` files. Compressed arrays (from `np.savez_compressed`) are read.
+
+  Args:
+    path: Path to the `.npz` file.
+    key: Name of the array in the archive. Defaults to `"arr_0"`.
+
+  Returns:
+    A read-only `np.memmap` if the array is stored uncompressed, otherwise a
+    NumPy array.
+  """
+  # `tf.numpy_function` passes paths as bytes, which `ZipFile` does not accept
+  path = os.fsdecode(path)
+  with zipfile.ZipFile(path) as zf:
+    info = zf.getinfo(key + ".npy")
+    with zf.open(info) as f:
+      if info.compress_type != zipfile.ZIP_STORED:
+        return np.lib.format.read_array(f)
+      version = np.lib.format.read_magic(f)
+      if version == (1, 0):
+        header = np.lib.format.read_array_header_1_0(f)
+      elif version == (2, 0):
+        header = np.lib.format.read_array_header_2_0(f)
+      else:
+        header = None
+      if header is None or header[2].hasobject:
+        with np.load(path) as npz:
+          return npz[key]
+      shape, fortran_order, dtype = header
+      header_size = f.tell()
+  # The member data starts after its local file header, whose size depends on
+  # the length of the name and extra fields stored in it
+  with open(path, "rb") as f:
+    f.seek(info.header_offset)
+    name_size, extra_size = struct.unpack("<HH", f.read(30)[26:30])
+  offset = info.header_offset + 30 + name_size + extra_size + header_size
+  return np.memmap(
+    path,
+    dtype=dtype,
+    mode="r",
+    offset=offset,
+    shape=shape,
+    order="F" if fortran_order else "C",
+  )
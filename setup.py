@@ -17,6 +17,9 @@ setup(
       'nibabel',
       'pydicom',
     ],
+    extras_require = {
+      'opencv': ['opencv-python-headless'],
+    },
     classifiers=[
         "Development Status :: 4 - Beta",
         "Intended Audience :: Developers",
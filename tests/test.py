@@ -1,8 +1,26 @@
+import os
+import tempfile
 import unittest
+import numpy as np
 import pandas as pd
-from imflow import imflow
+import tensorflow as tf
+from imflow import convert, imflow
+from imflow.utils import dataset_utils, image_utils, numpy_utils
 
 class TestImageLoad(unittest.TestCase):
+  def setUp(self):
+    tmp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(tmp_dir.cleanup)
+    self.tmp_dir = tmp_dir.name
+
+  def _tensor_files(self, n, shape=(16, 16)):
+    '''Writes `n` random `.npy` images and converts them to `.tensor` files.'''
+    paths = []
+    for i in range(n):
+      paths.append(os.path.join(self.tmp_dir, f'{i}.npy'))
+      np.save(paths[-1], np.random.rand(*shape))
+    return convert.numpy_to_tensor(paths)
+
   def test_image_file(self):
     df = pd.read_csv('./tests/data/binary_labels.csv')
     df['patientId'] += '.png'
@@ -45,5 +63,302 @@ class TestImageLoad(unittest.TestCase):
     except:
       self.fail('Image did not load correctly')
 
+  def test_tensor_file(self):
+    tensor_paths = self._tensor_files(4, (64, 48))
+    self.assertEqual(tensor_paths, [os.path.join(self.tmp_dir, f'{i}.tensor') for i in range(4)])
+    ds = imflow.image_dataset_from_paths_and_labels(
+      tensor_paths,
+      [0, 1, 0, 1],
+      label_mode = 'binary',
+      color_mode = 'rgb',
+      batch_size = 4,
+      image_size = (32,32),
+      shuffle = False
+    )
+    for X, _ in ds.take(1):
+      self.assertEqual(X.numpy().shape, (4,32,32,3), 'Reshape failed')
+
+  def test_graph_then_eager(self):
+    tensor_paths = self._tensor_files(2)
+    kwargs = dict(label_mode = None, batch_size = 2, image_size = (16,16), shuffle = False)
+    with tf.Graph().as_default():
+      imflow.image_dataset_from_paths_and_labels(tensor_paths, None, **kwargs)
+    ds = imflow.image_dataset_from_paths_and_labels(tensor_paths, None, **kwargs)
+    for X in ds:
+      self.assertEqual(X.numpy().shape, (2,16,16,3))
+
+  def test_uint8_dtype(self):
+    path = os.path.join(self.tmp_dir, 'x.npy')
+    np.save(path, np.array([[-3.2, 1.4], [1.6, 300.0]]))
+    ds = imflow.image_dataset_from_paths_and_labels(
+      convert.numpy_to_tensor([path]),
+      None,
+      label_mode = None,
+      color_mode = 'grayscale',
+      batch_size = 1,
+      image_size = (2,2),
+      shuffle = False,
+      interpolation = 'nearest',
+      dtype = 'uint8'
+    )
+    self.assertEqual(ds.element_spec.dtype, tf.uint8)
+    for X in ds:
+      np.testing.assert_array_equal(X.numpy()[0, ..., 0], [[0, 1], [2, 255]])
+
+  def _assert_opaque_rgba(self, path):
+    ds = imflow.image_dataset_from_paths_and_labels(
+      [path],
+      None,
+      label_mode = None,
+      color_mode = 'rgba',
+      batch_size = 1,
+      image_size = (8,8),
+      shuffle = False
+    )
+    for X in ds:
+      self.assertEqual(X.numpy().shape, (1,8,8,4))
+      np.testing.assert_array_equal(X.numpy()[..., 3], 255)
+
+  def test_jpeg_rgba(self):
+    path = os.path.join(self.tmp_dir, 'x.jpg')
+    img = np.random.randint(0, 256, (16, 16, 3), dtype=np.uint8)
+    tf.io.write_file(path, tf.io.encode_jpeg(img))
+    self._assert_opaque_rgba(path)
+
+  @unittest.skipUnless(image_utils.pil_image is not None, 'requires PIL')
+  def test_gif_rgba(self):
+    path = os.path.join(self.tmp_dir, 'x.gif')
+    img = np.random.randint(0, 256, (16, 16, 3), dtype=np.uint8)
+    image_utils.pil_image.fromarray(img).save(path)
+    self._assert_opaque_rgba(path)
+
+  def test_nullable_int_labels(self):
+    df = pd.DataFrame({
+      'path': [os.path.basename(p) for p in self._tensor_files(4)],
+      'label': pd.array([0, 2, 1, 2], dtype='Int64'),
+    })
+    ds = imflow.image_dataset_from_dataframe(
+      df,
+      'path',
+      'label',
+      image_dir = self.tmp_dir,
+      label_mode = 'int',
+      color_mode = 'grayscale',
+      batch_size = 4,
+      image_size = (16,16),
+      shuffle = False
+    )
+    for _, y in ds.take(1):
+      self.assertEqual(y.numpy().tolist(), [0, 2, 1, 2])
+
+  def test_cache_subsets(self):
+    tensor_paths = self._tensor_files(10)
+    labels = list(range(10))
+    cache = os.path.join(self.tmp_dir, 'cache')
+    for subset in ('training', 'validation'):
+      ds = imflow.image_dataset_from_paths_and_labels(
+        tensor_paths,
+        labels,
+        color_mode = 'grayscale',
+        batch_size = None,
+        image_size = (16,16),
+        shuffle = False,
+        seed = 1337,
+        validation_split = 0.2,
+        subset = subset,
+        cache = cache
+      )
+      expected = [labels[tensor_paths.index(p)] for p in ds.file_paths]
+      # Iterate twice so that the second pass is read from the cache files
+      for _ in range(2):
+        self.assertEqual([int(y) for _, y in ds], expected)
+
+  def test_cache_input_pipelines(self):
+    tensor_paths = self._tensor_files(6)
+    labels = list(range(6))
+    cache = os.path.join(self.tmp_dir, 'cache')
+    for i in range(2):
+      ds = imflow.image_dataset_from_paths_and_labels(
+        tensor_paths,
+        labels,
+        color_mode = 'grayscale',
+        batch_size = None,
+        image_size = (16,16),
+        shuffle = False,
+        cache = cache,
+        input_context = tf.distribute.InputContext(num_input_pipelines=2, input_pipeline_id=i)
+      )
+      for _ in range(2):
+        self.assertEqual([int(y) for _, y in ds], labels[i::2])
+
+  def test_prefetch_to_device(self):
+    tensor_paths = self._tensor_files(4)
+    ds = imflow.image_dataset_from_paths_and_labels(
+      tensor_paths,
+      [0, 1, 0, 1],
+      label_mode = 'binary',
+      color_mode = 'grayscale',
+      batch_size = 2,
+      image_size = (16,16),
+      shuffle = False,
+      device = '/CPU:0'
+    )
+    self.assertEqual([X.numpy().shape for X, _ in ds], [(2,16,16,1)] * 2)
+    with self.assertRaises(ValueError):
+      imflow.image_dataset_from_paths_and_labels(
+        tensor_paths,
+        [0, 1, 0, 1],
+        label_mode = 'binary',
+        device = '/CPU:0',
+        input_context = tf.distribute.InputContext()
+      )
+
+  def test_binary_labels(self):
+    paths = ['0.png', '1.png', '2.png']
+    for labels in ([1, 2, 1], [0, 0, 0], [0, 1, 2]):
+      with self.assertRaises(ValueError):
+        imflow.image_dataset_from_paths_and_labels(paths, labels, label_mode = 'binary')
+    ds = imflow.image_dataset_from_paths_and_labels(paths, [0, 1, 0], label_mode = 'binary')
+    self.assertEqual(ds.element_spec[1].shape.as_list(), [None, 1])
+
+class TestConvert(unittest.TestCase):
+  def test_output_dir(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      paths = []
+      for name in ('a', 'b'):
+        os.makedirs(os.path.join(tmp_dir, name))
+        paths.append(os.path.join(tmp_dir, name, 'slice_001.npz'))
+        np.savez(paths[-1], np.random.rand(16, 16))
+      output_dir = os.path.join(tmp_dir, 'out', 'a')
+      self.assertEqual(
+        convert.numpy_to_tensor(paths[:1], output_dir),
+        [os.path.join(output_dir, 'slice_001.tensor')]
+      )
+      with self.assertRaises(ValueError):
+        convert.numpy_to_tensor(paths, os.path.join(tmp_dir, 'out', 'b'))
+      self.assertFalse(os.path.exists(os.path.join(tmp_dir, 'out', 'b')))
+
+class TestIndexDirectory(unittest.TestCase):
+  def test_fast_index(self):
+    args = ('./tests/data/images', 'inferred', 'int', imflow.ALLOWLIST_FORMATS)
+    paths, labels, class_names = dataset_utils.index_directory(*args, shuffle=False)
+    fast_paths, fast_labels, fast_class_names = dataset_utils.index_directory_fast(*args, shuffle=False)
+    self.assertEqual([os.path.normpath(p) for p in fast_paths], [os.path.normpath(p) for p in paths])
+    self.assertEqual(fast_labels.tolist(), labels.tolist())
+    self.assertEqual(fast_class_names, class_names)
+
+  def test_fast_index_glob_characters(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      directory = os.path.join(tmp_dir, 'data[1]')
+      for class_name in ('a[0-9]', 'b*?', 'c1'):
+        os.makedirs(os.path.join(directory, class_name))
+        for name in ('x.png', 'y[1].png'):
+          open(os.path.join(directory, class_name, name), 'wb').close()
+      args = (directory, 'inferred', 'int', imflow.ALLOWLIST_FORMATS)
+      paths, labels, _ = dataset_utils.index_directory(*args, shuffle=False)
+      fast_paths, fast_labels, _ = dataset_utils.index_directory_fast(*args, shuffle=False)
+      self.assertEqual(len(fast_paths), 6)
+      self.assertEqual([os.path.normpath(p) for p in fast_paths], [os.path.normpath(p) for p in paths])
+      self.assertEqual(fast_labels.tolist(), labels.tolist())
+
+  def test_shuffle_explicit_labels(self):
+    for index in (dataset_utils.index_directory, dataset_utils.index_directory_fast):
+      paths, _, _ = index('./tests/data/images/png', None, None, imflow.ALLOWLIST_FORMATS, shuffle=False)
+      paths = list(paths)
+      labels = list(range(len(paths)))
+      shuffled_paths, shuffled_labels, _ = index('./tests/data/images/png', labels, 'int', imflow.ALLOWLIST_FORMATS, shuffle=True, seed=1337)
+      self.assertEqual([paths.index(p) for p in shuffled_paths], shuffled_labels.tolist())
+      self.assertEqual(labels, list(range(len(paths))))
+
+class TestDatasetUtils(unittest.TestCase):
+  def test_training_or_validation_split(self):
+    samples = [f'{i}.png' for i in range(10)]
+    labels = list(range(10))
+    train_samples, train_labels = dataset_utils.get_training_or_validation_split(samples, labels, 0.2, 'training')
+    val_samples, val_labels = dataset_utils.get_training_or_validation_split(samples, labels, 0.2, 'validation')
+    self.assertEqual(train_samples.tolist(), samples[:8])
+    self.assertEqual(train_labels.tolist(), labels[:8])
+    self.assertEqual(val_samples.tolist(), samples[8:])
+    self.assertEqual(val_labels.tolist(), labels[8:])
+
+  def test_split_without_labels(self):
+    samples = [f'{i}.png' for i in range(10)]
+    for subset, expected in (('training', samples[:7]), ('validation', samples[7:])):
+      split_samples, split_labels = dataset_utils.get_training_or_validation_split(samples, None, 0.3, subset)
+      self.assertEqual(split_samples.tolist(), expected)
+      self.assertIsNone(split_labels)
+
+  def test_empty_validation_split(self):
+    samples = [f'{i}.png' for i in range(4)]
+    train_samples, _ = dataset_utils.get_training_or_validation_split(samples, [0, 1, 0, 1], 0.2, 'training')
+    val_samples, _ = dataset_utils.get_training_or_validation_split(samples, [0, 1, 0, 1], 0.2, 'validation')
+    self.assertEqual(train_samples.tolist(), samples)
+    self.assertEqual(val_samples.tolist(), [])
+
+  def test_shard_input_pipeline(self):
+    shards = []
+    for i in range(2):
+      paths, _, _ = dataset_utils.index_directory('./tests/data/images/png', None, None, imflow.ALLOWLIST_FORMATS, shuffle=True, seed=1337)
+      input_context = tf.distribute.InputContext(num_input_pipelines=2, input_pipeline_id=i)
+      shard, _ = dataset_utils.shard_input_pipeline(paths, None, input_context)
+      shards.append(set(shard.tolist()))
+    self.assertFalse(shards[0] & shards[1])
+    self.assertEqual(shards[0] | shards[1], set(paths))
+
+  def test_shard_requires_seed(self):
+    with self.assertRaises(ValueError):
+      imflow.image_dataset_from_directory(
+        './tests/data/images',
+        shuffle = True,
+        input_context = tf.distribute.InputContext(num_input_pipelines=2, input_pipeline_id=0)
+      )
+
+class TestExtension(unittest.TestCase):
+  def test_path_extension(self):
+    long_dir = '/data.v2/' + 'a' * 300 + '/'
+    for path, ext in (
+      ('x.npz', 'npz'),
+      ('IMG.JPG', 'jpg'),
+      ('scan.Dcm', 'dcm'),
+      (long_dir + 'slice_001.tensor', 'tensor'),
+      (long_dir + 'image.jpeg', 'jpeg'),
+    ):
+      self.assertEqual(imflow._path_extension(tf.constant(path)).numpy().decode(), ext)
+
+  def test_extension_dispatch(self):
+    table = imflow._extension_table()
+    codes = [int(table.lookup(imflow._path_extension(tf.constant(path)))) for path in ('a/b.PNG', 'a.b/c', 'c.tiff')]
+    self.assertEqual(codes, [imflow._EXT_CODE['png'], max(imflow._EXT_CODE.values()) + 1, max(imflow._EXT_CODE.values()) + 1])
+
+@unittest.skipUnless(image_utils.cv2 is not None, 'requires OpenCV')
+class TestImageUtils(unittest.TestCase):
+  def test_cv_resize(self):
+    x = np.random.rand(8, 8, 3).astype(np.float32)
+    y = image_utils.cv_resize(x, (16, 16), image_utils.get_cv_interpolation('bilinear'))
+    np.testing.assert_allclose(y, tf.image.resize(x, (16, 16)).numpy(), atol=1e-4)
+
+  def test_cv_resize_with_pad(self):
+    x = np.ones((30, 60, 1), dtype=np.float32)
+    for size in ((32, 32), (48, 20)):
+      y = image_utils.cv_resize(x, size, image_utils.get_cv_interpolation('bilinear'), pad=True)
+      self.assertEqual(y.shape, size + (1,))
+      np.testing.assert_allclose(y, tf.image.resize_with_pad(x, *size).numpy(), atol=1e-4)
+
+class TestNumpyUtils(unittest.TestCase):
+  def test_load_npz_array(self):
+    x = np.random.rand(64, 48).astype(np.float32)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      for save in (np.savez, np.savez_compressed):
+        path = os.path.join(tmp_dir, f'{save.__name__}.npz')
+        save(path, x)
+        np.testing.assert_array_equal(numpy_utils.load_npz_array(path.encode()), x)
+
+  def test_numpy_image(self):
+    for dtype in ('<i2', '>i2', '>f4', np.float16, np.uint8, bool):
+      x = (np.arange(12).reshape(3, 4) % 2).astype(dtype)
+      y = imflow.numpy_image(x)
+      self.assertEqual(y.dtype, np.float32)
+      np.testing.assert_array_equal(y, x.astype(np.float32)[..., None])
+
 if __name__ == '__main__':
   unittest.main()
\ No newline at end of file